@@ -9,190 +9,574 @@ import os
 import sys
 import time
 import threading
-import subprocess
-import json
-import csv
+import asyncio
+import argparse
+import copy
+import functools
+import multiprocessing
+import string
+from array import array
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import orjson
 import psutil
-import GPUtil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+Gst.init(None)
+
+DETECTION_MODEL = "person-detection-retail-0013"
+CLASSIFICATION_MODEL = "person-attributes-recognition-crossroad-0230"
+
+# INT8 weights halve memory traffic and let OpenVINO use the VNNI/AMX
+# int8 kernels on CPU and DP4A/XMX on GPU
+MODEL_PRECISION = "FP16-INT8"
+
+# i915 exposes the Intel GPU's vendor id and frequencies through sysfs
+INTEL_GPU_SYSFS = Path("/sys/class/drm/card0")
+INTEL_VENDOR_ID = "0x8086"
+
+RESOURCE_COLUMNS = (
+    'timestamp', 'cpu_percent', 'memory_percent', 'gpu_util', 'gpu_memory', 'gpu_freq_percent'
+)
+
+# One row per benchmarked configuration, stored column-wise
+RESULTS_DTYPE = np.dtype([
+    ('device', 'U3'),
+    ('num_streams', 'i4'),
+    ('target_fps', 'i4'),
+    ('successful_streams', 'i4'),
+    ('avg_fps_per_stream', 'f4'),
+    ('total_fps', 'f4'),
+    ('total_detections', 'i4'),
+    ('avg_cpu_percent', 'f4'),
+    ('avg_gpu_util', 'f4'),
+    ('avg_gpu_freq_percent', 'f4'),
+    ('timestamp', 'M8[ms]')
+])
+
+# Pipeline branch for one stream. Device-specific fields are filled in once
+# per StreamProcessor; $source, $stream_id, $fps_target, $batch_size,
+# $decode_threads and $leaky are filled in per stream.
+#
+# Streams sharing a model-instance-id share one compiled model and one
+# inference queue, so frames from all sources are batched together.
+# CACHE_DIR lets OpenVINO reuse the compiled blob on later runs. Person
+# attributes are stable across frames, so classification only runs on every
+# Nth frame.
+#
+# Queues split decode, pre-processing, detection and classification into
+# their own threads so the stages overlap instead of running back to back.
+# For live sources the queues leak, dropping stale frames rather than
+# stalling a source that will not wait. File sources keep backpressure so
+# the decoder is paced by inference instead of decoding frames that are
+# then discarded. Inference gets its own thread, so the stream's source,
+# decode and pre-processing threads can be pinned on their own.
+#
+# Every frame gets a JSON record, even with no detections, tagged with the
+# stream id so the shared metadata sink below can tell streams apart.
+BRANCH_TEMPLATE = """
+$source ! 
+parsebin name=parse_$stream_id ! 
+$decode !
+queue name=infer_queue_$stream_id max-size-buffers=4 leaky=$leaky !
+gvadetect name=detect_$stream_id 
+    model=$detection_model 
+    $device_config 
+    threshold=$threshold 
+    batch-size=$batch_size 
+    nireq=$batch_size 
+    ie-config=CACHE_DIR=$cache_dir 
+    model-instance-id=det_$device !
+queue name=classify_queue_$stream_id max-size-buffers=2 leaky=$leaky !
+gvaclassify name=classify_$stream_id 
+    model=$classification_model 
+    $device_config 
+    ie-config=CACHE_DIR=$cache_dir 
+    inference-interval=$classify_every_n 
+    reclassify-interval=30 
+    model-instance-id=cls_$device !
+gvametaconvert name=meta_$stream_id format=json add-tensor-data=false add-empty-results=true source=$stream_id !
+mux.
+"""
+
+# Name prefixes of the elements in a stream's branch, suffixed with its id.
+# Every element of the branch is named so that its errors, including decode
+# and caps negotiation failures, are charged to that stream alone.
+BRANCH_ELEMENT_PREFIXES = (
+    'src_', 'parse_', 'decode_', 'decode_queue_', 'postproc_', 'convert_',
+    'scale_', 'rate_', 'caps_', 'infer_queue_', 'detect_', 'classify_queue_',
+    'classify_', 'meta_'
+)
+
+# All branches funnel into one publisher that writes one JSON line per frame,
+# so metadata leaves the pipeline as a single byte stream rather than one
+# Python signal emission per stream per frame
+METADATA_SINK_TEMPLATE = string.Template(
+    "funnel name=mux ! "
+    "gvametapublish method=file file-format=json-lines file-path=$metadata_path ! "
+    "fakesink sync=false async=false"
+)
+
+# Keep frames in VA surfaces from decode through inference so they never
+# round-trip through system memory. vapostproc does no rate conversion, so
+# videorate (which accepts any memory type) caps sources above the FPS target.
+GPU_DECODE = """
+vah264dec name=decode_$stream_id ! 
+queue name=decode_queue_$stream_id max-size-buffers=4 leaky=$leaky ! 
+vapostproc name=postproc_$stream_id ! 
+videorate name=rate_$stream_id drop-only=true max-rate=$fps_target ! 
+capsfilter name=caps_$stream_id caps="video/x-raw(memory:VAMemory),width=640,height=480"
+"""
+GPU_DEVICE_CONFIG = "device=GPU pre-process-backend=va-surface-sharing"
+
+# Slice threading avoids the extra latency of frame threading. videorate
+# only drops frames: duplicating them to reach a target above the source
+# rate would run inference on repeats and count them as processed frames.
+CPU_DECODE = """
+avdec_h264 name=decode_$stream_id max-threads=$decode_threads thread-type=slice ! 
+queue name=decode_queue_$stream_id max-size-buffers=4 leaky=$leaky ! 
+videoconvert name=convert_$stream_id ! 
+videoscale name=scale_$stream_id ! 
+videorate name=rate_$stream_id drop-only=true max-rate=$fps_target ! 
+capsfilter name=caps_$stream_id caps="video/x-raw,width=640,height=480"
+"""
+CPU_DEVICE_CONFIG = "device=CPU"
 
 class StreamProcessor:
-    def __init__(self, device="CPU", model_path="", detection_threshold=0.5):
+    def __init__(self, device="CPU", model_path="", detection_threshold=0.5,
+                 model_cache_dir="./ov_cache", classify_every_n=5, model_precision=MODEL_PRECISION):
         self.device = device
         self.model_path = model_path
+        self.model_precision = model_precision
         self.detection_threshold = detection_threshold
+        self.model_cache_dir = model_cache_dir
+        self.classify_every_n = classify_every_n
         self.active_streams = []
         self.performance_data = []
         
-    def create_gst_pipeline(self, input_source, stream_id, fps_target=30):
+        # Resolve everything that is fixed for this processor up front so
+        # each stream only substitutes its own fields
+        if device == "GPU":
+            decode, device_config = GPU_DECODE, GPU_DEVICE_CONFIG
+        else:
+            decode, device_config = CPU_DECODE, CPU_DEVICE_CONFIG
+        branch = string.Template(BRANCH_TEMPLATE).safe_substitute(
+            decode=decode,
+            device_config=device_config,
+            device=device,
+            detection_model=model_xml(model_path, DETECTION_MODEL, model_precision),
+            classification_model=model_xml(model_path, CLASSIFICATION_MODEL, model_precision),
+            threshold=detection_threshold,
+            cache_dir=model_cache_dir,
+            classify_every_n=classify_every_n
+        )
+        self._branch_template = string.Template(' '.join(branch.split()))
+        
+    def create_gst_pipeline(self, input_source, stream_id, fps_target=30, batch_size=1,
+                            num_concurrent_streams=1, metadata_path="/dev/stdout"):
         """Create GStreamer pipeline string for DL Streamer"""
         
+        branch = self._create_branch(
+            input_source, stream_id, fps_target, batch_size, num_concurrent_streams
+        )
+        return f"{METADATA_SINK_TEMPLATE.substitute(metadata_path=metadata_path)} {branch}"
+    
+    def _create_branch(self, input_source, stream_id, fps_target, batch_size,
+                       num_concurrent_streams):
+        """Create the decode and inference branch for one stream, ending at the metadata funnel"""
+        
         # Base pipeline components
         if input_source.startswith('rtsp://') or input_source.startswith('http'):
-            source = f"urisourcebin uri={input_source}"
-        else:
-            source = f"filesrc location={input_source}"
-            
-        # Device-specific inference configuration
-        if self.device == "GPU":
-            device_config = "device=GPU"
-            inference_element = "gvadetect"
+            source = f"urisourcebin name=src_{stream_id} uri={input_source}"
+            leaky = "downstream"
         else:
-            device_config = "device=CPU"
-            inference_element = "gvadetect"
+            source = f"filesrc name=src_{stream_id} location={input_source}"
+            leaky = "no"
             
-        pipeline = f"""
-        {source} ! 
-        decodebin ! 
-        videoconvert ! 
-        videoscale ! 
-        video/x-raw,width=640,height=480,framerate={fps_target}/1 !
-        {inference_element} 
-            model={self.model_path}/person-detection-retail-0013.xml 
-            {device_config} 
-            threshold={self.detection_threshold} !
-        gvaclassify 
-            model={self.model_path}/person-attributes-recognition-crossroad-0230.xml 
-            {device_config} !
-        gvametaconvert format=json !
-        appsink name=sink_{stream_id} emit-signals=true sync=false
-        """
-        
-        return pipeline.replace('\n', ' ').strip()
+        # Split the logical cores between concurrent CPU decoders
+        decode_threads = max(1, psutil.cpu_count(logical=True) // max(1, num_concurrent_streams))
+        
+        return self._branch_template.substitute(
+            source=source,
+            stream_id=stream_id,
+            fps_target=fps_target,
+            batch_size=batch_size,
+            decode_threads=decode_threads,
+            leaky=leaky
+        )
+    
+    def create_batched_pipeline(self, sources, fps_target=30, stream_offset=0,
+                                num_concurrent_streams=None, metadata_path="/dev/stdout"):
+        """Create one pipeline with a branch per source sharing the inference engine"""
+        
+        branches = [METADATA_SINK_TEMPLATE.substitute(metadata_path=metadata_path)]
+        branches.extend(
+            self._create_branch(
+                source,
+                f"stream_{i}",
+                fps_target,
+                batch_size=len(sources),
+                num_concurrent_streams=num_concurrent_streams or len(sources)
+            )
+            for i, source in enumerate(sources, start=stream_offset)
+        )
+        
+        return ' '.join(branches)
     
     def run_single_stream(self, video_path, stream_id, duration=60, fps_target=30):
         """Run a single video stream and collect performance metrics"""
         
-        pipeline_str = self.create_gst_pipeline(video_path, stream_id, fps_target)
+        create_pipeline = functools.partial(
+            self.create_gst_pipeline, video_path, stream_id, fps_target
+        )
+        return self._run_pipeline(create_pipeline, [stream_id], duration, fps_target)[0]
+    
+    def run_batched_streams(self, sources, duration=60, fps_target=30, stream_offset=0,
+                            num_concurrent_streams=None, start_barrier=None):
+        """Run all sources through one batched pipeline and collect per-stream metrics"""
         
-        # Create GStreamer command
-        cmd = [
-            'gst-launch-1.0',
-            '-e',  # Send EOS on interrupt
-            pipeline_str
-        ]
+        create_pipeline = functools.partial(
+            self.create_batched_pipeline, sources, fps_target, stream_offset, num_concurrent_streams
+        )
+        stream_ids = [f"stream_{i}" for i in range(stream_offset, stream_offset + len(sources))]
+        return self._run_pipeline(
+            create_pipeline, stream_ids, duration, fps_target,
+            stream_offset, num_concurrent_streams or len(sources), start_barrier
+        )
+    
+    def _run_pipeline(self, create_pipeline, stream_ids, duration, fps_target,
+                      stream_offset=0, total_streams=None, start_barrier=None):
+        """Play a pipeline and count the per-stream metadata lines it publishes"""
+        
+        # The pipeline publishes into a pipe read by a single thread, which
+        # is the only writer of the counters. Arrival times of each stream's
+        # first and last record bound the window its FPS is measured over,
+        # since streams of different lengths finish at different times.
+        counters = {
+            stream_id: {'frames': 0, 'detections': 0, 'first': 0.0, 'last': 0.0}
+            for stream_id in stream_ids
+        }
+        loop = GLib.MainLoop()
+        errors = []
+        stream_errors = {}
+        
+        # Lets a bus message be traced back to the branch that posted it
+        branch_elements = {
+            f"{prefix}{stream_id}": stream_id
+            for stream_id in stream_ids
+            for prefix in BRANCH_ELEMENT_PREFIXES
+        }
+        
+        def read_metadata(read_fd):
+            with os.fdopen(read_fd, 'rb') as lines:
+                for line in lines:
+                    try:
+                        meta = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+                    stream_counters = counters.get(meta.get('source'))
+                    if stream_counters is not None:
+                        now = time.monotonic()
+                        if not stream_counters['frames']:
+                            stream_counters['first'] = now
+                        stream_counters['last'] = now
+                        stream_counters['frames'] += 1
+                        stream_counters['detections'] += len(meta.get('objects', ()))
+        
+        def on_message(bus, message):
+            if message.type == Gst.MessageType.ERROR:
+                err, _ = message.parse_error()
+                
+                # An error inside one branch only fails that stream; the
+                # others keep running. Anything else fails the pipeline.
+                name = _find_named_ancestor(message.src, branch_elements)
+                if name is None:
+                    errors.append(err.message)
+                    loop.quit()
+                else:
+                    stream_id = branch_elements[name]
+                    if stream_id not in stream_errors:
+                        stream_errors[stream_id] = err.message
+                        # funnel only forwards EOS once every branch has
+                        # sent one, and this branch never will
+                        _end_branch(pipeline, stream_id)
+                    if len(stream_errors) == len(stream_ids):
+                        loop.quit()
+            elif message.type == Gst.MessageType.EOS:
+                loop.quit()
+        
+        def on_timeout(_):
+            loop.quit()
+            return GLib.SOURCE_REMOVE
+        
+        def on_stream_status(bus, message):
+            status_type, owner = message.parse_stream_status()
+            if status_type != Gst.StreamStatusType.ENTER:
+                return
+                
+            # Elements inside parsebin/urisourcebin are matched via their bin.
+            # The task pool reuses idle threads, so a thread entering any
+            # other element is reset in case it was pinned by an earlier task.
+            name = _find_named_ancestor(owner, stream_cpus)
+            os.sched_setaffinity(0, stream_cpus[name] if name is not None else process_cpus)
+        
+        # Shard streams across NUMA nodes in contiguous blocks so each
+        # stream's source, demux, decode and pre-processing threads (and the
+        # libav threads they spawn) stay next to the frames they produce.
+        # Inference sits behind infer_queue and is left to OpenVINO's own
+        # thread placement. Blocks are cut over the global stream numbers so
+        # that shards run in separate processes still split the nodes
+        # between them instead of each spreading over all of them.
+        process_cpus = os.sched_getaffinity(0)
+        cpusets = numa_cpusets()
+        stream_cpus = {}
+        if len(cpusets) > 1:
+            total_streams = total_streams or len(stream_ids)
+            for i, stream_id in enumerate(stream_ids, start=stream_offset):
+                cpus = cpusets[i * len(cpusets) // total_streams]
+                stream_cpus[f"src_{stream_id}"] = cpus
+                stream_cpus[f"parse_{stream_id}"] = cpus
+                stream_cpus[f"decode_queue_{stream_id}"] = cpus
+        
+        read_fd, write_fd = os.pipe()
+        reader = threading.Thread(target=read_metadata, args=(read_fd,), daemon=True)
+        reader.start()
         
-        start_time = time.time()
-        process = None
+        pipeline = None
+        bus = None
+        timer = None
         
         try:
-            # Start the pipeline
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
+            pipeline = Gst.parse_launch(create_pipeline(metadata_path=f"/dev/fd/{write_fd}"))
             
-            # Monitor performance
-            frame_count = 0
-            detection_count = 0
+            # EOS and errors are dispatched on the main loop, which also
+            # owns the duration timer
+            bus = pipeline.get_bus()
+            bus.add_signal_watch()
+            bus.connect('message', on_message)
             
-            # Run for specified duration
-            while time.time() - start_time < duration:
-                if process.poll() is not None:
-                    break
-                    
-                # Simulate frame processing (in real implementation, 
-                # you'd parse the JSON metadata from appsink)
-                time.sleep(1.0/fps_target)
-                frame_count += 1
-                
-                # Simulate detections (would come from actual inference)
-                if frame_count % 10 == 0:  # Assume detection every 10 frames
-                    detection_count += 1
+            # Stream status is handled synchronously on the thread that is
+            # starting, which is what lets it pin itself
+            if stream_cpus:
+                bus.enable_sync_message_emission()
+                bus.connect('sync-message::stream-status', on_stream_status)
             
-            end_time = time.time()
-            actual_duration = end_time - start_time
-            actual_fps = frame_count / actual_duration if actual_duration > 0 else 0
+            if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                raise RuntimeError(f"Failed to start pipeline for {', '.join(stream_ids)}")
+            
+            # Pipelines in other processes running alongside this one only
+            # start their timers once every one of them is playing
+            if start_barrier is not None:
+                pipeline.get_state(Gst.CLOCK_TIME_NONE)
+                _pass_barrier(start_barrier)
+                start_barrier = None
+            
+            # Run for specified duration or until the streams end
+            timer = GLib.timeout_source_new_seconds(duration)
+            timer.set_callback(on_timeout)
+            timer.attach(loop.get_context())
+            loop.run()
+            
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            # A pipeline that failed to start must not hold the others back
+            if start_barrier is not None:
+                _pass_barrier(start_barrier)
+            if timer is not None:
+                timer.destroy()
+            if bus is not None:
+                bus.remove_signal_watch()
+            if pipeline is not None:
+                pipeline.set_state(Gst.State.NULL)
+            # gvametapublish has closed its end; closing ours lets the
+            # reader drain what is left in the pipe and finish
+            os.close(write_fd)
+            reader.join()
+        
+        if errors:
+            return [{
+                'stream_id': stream_id,
+                'device': self.device,
+                'error': errors[0],
+                'success': False
+            } for stream_id in stream_ids]
+        
+        results = []
+        for stream_id in stream_ids:
+            if stream_id in stream_errors:
+                results.append({
+                    'stream_id': stream_id,
+                    'device': self.device,
+                    'error': stream_errors[stream_id],
+                    'success': False
+                })
+                continue
+                
+            # Rate over the intervals between this stream's own records
+            frame_count = counters[stream_id]['frames']
+            actual_duration = counters[stream_id]['last'] - counters[stream_id]['first']
+            actual_fps = (frame_count - 1) / actual_duration if actual_duration > 0 else 0
             
-            return {
+            results.append({
                 'stream_id': stream_id,
                 'device': self.device,
                 'target_fps': fps_target,
                 'actual_fps': actual_fps,
                 'frames_processed': frame_count,
-                'detections': detection_count,
+                'detections': counters[stream_id]['detections'],
                 'duration': actual_duration,
                 'success': True
-            }
-            
-        except Exception as e:
-            return {
-                'stream_id': stream_id,
-                'device': self.device,
-                'error': str(e),
-                'success': False
-            }
-        finally:
-            if process:
-                process.terminate()
-                try:
-                    process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    process.kill()
+            })
+        
+        return results
 
 class PerformanceBenchmark:
     def __init__(self, model_path="./models"):
         self.model_path = model_path
-        self.results = []
+        self._results = np.empty(16, dtype=RESULTS_DTYPE)
+        self._num_results = 0
+        self.resource_samples = {name: array('f') for name in RESOURCE_COLUMNS}
+        
+        # Resolve GPU handles once so each sample is a single driver query
+        # instead of an nvidia-smi subprocess
+        self._nvml_handles = []
+        if pynvml is not None:
+            try:
+                pynvml.nvmlInit()
+                self._nvml_handles = [
+                    pynvml.nvmlDeviceGetHandleByIndex(i)
+                    for i in range(pynvml.nvmlDeviceGetCount())
+                ]
+            except pynvml.NVMLError:
+                pass
+        self._intel_gpu = _find_intel_gpu()
+        self._system_info = None
         
+    @property
+    def results(self):
+        """Structured array of the benchmark rows collected so far"""
+        return self._results[:self._num_results]
+    
+    def _append_result(self, row):
+        """Store one result row, doubling the backing array when it is full"""
+        if self._num_results == len(self._results):
+            self._results = np.resize(self._results, 2 * len(self._results))
+        self._results[self._num_results] = row
+        self._num_results += 1
+    
     def get_system_info(self):
         """Collect system specifications"""
+        # Hardware does not change mid-run, so this is collected once per
+        # benchmark; callers get their own copy to modify freely
+        if self._system_info is None:
+            self._system_info = self._collect_system_info()
+        return copy.deepcopy(self._system_info)
+    
+    def _collect_system_info(self):
+        """Snapshot CPU, memory and GPU specifications"""
+        freq = psutil.cpu_freq()
+        memory = psutil.virtual_memory()
         cpu_info = {
             'cpu_count': psutil.cpu_count(logical=False),
             'cpu_count_logical': psutil.cpu_count(logical=True),
-            'cpu_freq': psutil.cpu_freq().current if psutil.cpu_freq() else 0,
-            'memory_total': psutil.virtual_memory().total,
-            'memory_available': psutil.virtual_memory().available
+            'cpu_freq': freq.current if freq else 0,
+            'memory_total': memory.total,
+            'memory_available': memory.available
         }
         
         gpu_info = []
         try:
-            gpus = GPUtil.getGPUs()
-            for gpu in gpus:
+            for handle in self._nvml_handles:
+                memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                name = pynvml.nvmlDeviceGetName(handle)
                 gpu_info.append({
-                    'name': gpu.name,
-                    'memory_total': gpu.memoryTotal,
-                    'memory_free': gpu.memoryFree
+                    # Older pynvml releases return the name as bytes
+                    'name': name.decode() if isinstance(name, bytes) else name,
+                    'memory_total': memory.total // (1024**2),
+                    'memory_free': memory.free // (1024**2)
                 })
-        except:
+            if self._intel_gpu is not None:
+                # Intel integrated GPUs share system memory
+                device_id = (self._intel_gpu / 'device' / 'device').read_text().strip()
+                gpu_info.append({'name': f"Intel GPU {device_id}", 'memory_total': 0, 'memory_free': 0})
+        except Exception:
+            gpu_info = []
+        if not gpu_info:
             gpu_info = [{'name': 'No GPU detected', 'memory_total': 0, 'memory_free': 0}]
             
         return {'cpu': cpu_info, 'gpu': gpu_info}
     
-    def monitor_resources(self, duration=60):
+    def monitor_resources(self, duration=60, stop_event=None, sample_interval=0.1):
         """Monitor CPU, GPU, and memory usage during benchmark"""
-        start_time = time.time()
-        resource_data = []
+        # One float column per metric instead of a dict per sample
+        resource_data = {name: array('f') for name in RESOURCE_COLUMNS}
+        self.resource_samples = resource_data
+        stop_event = stop_event or threading.Event()
+        
+        # Seed the CPU counters; later non-blocking calls report usage
+        # since the previous call
+        psutil.cpu_percent(interval=None)
         
-        while time.time() - start_time < duration:
-            cpu_percent = psutil.cpu_percent(interval=1)
+        start_time = time.monotonic()
+        next_sample = start_time + sample_interval
+        
+        while next_sample - start_time <= duration:
+            if stop_event.wait(max(0, next_sample - time.monotonic())):
+                break
+            next_sample += sample_interval
+            
+            cpu_percent = psutil.cpu_percent(interval=None)
             memory_percent = psutil.virtual_memory().percent
             
             gpu_util = 0
             gpu_memory = 0
+            gpu_freq_percent = 0
             try:
-                gpus = GPUtil.getGPUs()
-                if gpus:
-                    gpu_util = gpus[0].load * 100
-                    gpu_memory = (gpus[0].memoryUsed / gpus[0].memoryTotal) * 100
+                gpu_util, gpu_memory, gpu_freq_percent = self._sample_gpu()
             except:
                 pass
                 
-            resource_data.append({
-                'timestamp': time.time() - start_time,
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory_percent,
-                'gpu_util': gpu_util,
-                'gpu_memory': gpu_memory
-            })
+            resource_data['timestamp'].append(time.monotonic() - start_time)
+            resource_data['cpu_percent'].append(cpu_percent)
+            resource_data['memory_percent'].append(memory_percent)
+            resource_data['gpu_util'].append(gpu_util)
+            resource_data['gpu_memory'].append(gpu_memory)
+            resource_data['gpu_freq_percent'].append(gpu_freq_percent)
             
         return resource_data
     
-    def benchmark_streams(self, video_files, device="CPU", max_streams=8, fps_targets=[15, 30]):
+    def _sample_gpu(self):
+        """Return GPU utilization, memory usage and clock percentages for the benchmarked GPU"""
+        # device=GPU runs on the Intel GPU, so it is measured even when an
+        # NVIDIA card is also present
+        if self._intel_gpu is not None:
+            # i915 has no utilization counter in sysfs; the clock relative to
+            # its maximum is recorded on its own since it is not a load figure
+            cur_freq = int((self._intel_gpu / 'gt_cur_freq_mhz').read_text())
+            max_freq = int((self._intel_gpu / 'gt_max_freq_mhz').read_text())
+            return 0, 0, (cur_freq / max_freq) * 100
+        
+        if self._nvml_handles:
+            handle = self._nvml_handles[0]
+            utilization = pynvml.nvmlDeviceGetUtilizationRates(handle)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            return utilization.gpu, (memory.used / memory.total) * 100, 0
+        
+        return 0, 0, 0
+    
+    def benchmark_streams(self, video_files, device="CPU", max_streams=8, fps_targets=[15, 30],
+                          num_workers=1):
         """Benchmark multiple streams with different configurations"""
         
         print(f"\n=== Benchmarking on {device} ===")
@@ -204,8 +588,10 @@ class PerformanceBenchmark:
                 print(f"Testing {num_streams} streams...")
                 
                 # Start resource monitoring
+                stop_monitor = threading.Event()
                 resource_monitor = threading.Thread(
-                    target=lambda: self.monitor_resources(65),
+                    target=self.monitor_resources,
+                    args=(65, stop_monitor),
                     daemon=True
                 )
                 resource_monitor.start()
@@ -216,90 +602,152 @@ class PerformanceBenchmark:
                     model_path=self.model_path
                 )
                 
-                # Run multiple streams concurrently
-                with ThreadPoolExecutor(max_workers=num_streams) as executor:
-                    futures = []
-                    for i in range(num_streams):
-                        video_file = video_files[i % len(video_files)]
-                        future = executor.submit(
-                            processor.run_single_stream,
-                            video_file,
-                            f"stream_{i}",
-                            60,  # duration
-                            fps_target
-                        )
-                        futures.append(future)
-                    
-                    # Collect results
-                    stream_results = []
-                    for future in as_completed(futures):
-                        result = future.result()
-                        stream_results.append(result)
+                # Run all streams through a single batched pipeline, or one
+                # batched pipeline per worker process
+                sources = [video_files[i % len(video_files)] for i in range(num_streams)]
+                if num_workers > 1:
+                    stream_results = self._run_sharded_streams(
+                        processor,
+                        sources,
+                        60,  # duration
+                        fps_target,
+                        num_workers
+                    )
+                else:
+                    stream_results = processor.run_batched_streams(
+                        sources,
+                        60,  # duration
+                        fps_target
+                    )
                 
-                # Calculate aggregate metrics
-                successful_streams = [r for r in stream_results if r['success']]
+                # Stop monitoring so the samples cover only this run
+                stop_monitor.set()
+                resource_monitor.join()
+                resources = self.resource_samples
                 
-                if successful_streams:
-                    avg_fps = sum(r['actual_fps'] for r in successful_streams) / len(successful_streams)
-                    total_detections = sum(r['detections'] for r in successful_streams)
-                    
-                    result = {
-                        'device': device,
-                        'num_streams': num_streams,
-                        'target_fps': fps_target,
-                        'successful_streams': len(successful_streams),
-                        'avg_fps_per_stream': avg_fps,
-                        'total_fps': avg_fps * len(successful_streams),
-                        'total_detections': total_detections,
-                        'timestamp': datetime.now().isoformat()
-                    }
+                # Calculate aggregate metrics over per-stream columns
+                success = np.fromiter((r['success'] for r in stream_results), dtype=bool, count=num_streams)
+                actual_fps = np.fromiter(
+                    (r.get('actual_fps', 0.0) for r in stream_results), dtype=np.float32, count=num_streams
+                )
+                detections = np.fromiter(
+                    (r.get('detections', 0) for r in stream_results), dtype=np.int64, count=num_streams
+                )
+                num_successful = int(success.sum())
+                
+                if num_successful:
+                    avg_fps = float(actual_fps[success].mean())
+                    total_detections = int(detections[success].sum())
                     
-                    self.results.append(result)
+                    self._append_result((
+                        device,
+                        num_streams,
+                        fps_target,
+                        num_successful,
+                        avg_fps,
+                        avg_fps * num_successful,
+                        total_detections,
+                        _column_mean(resources['cpu_percent']),
+                        _column_mean(resources['gpu_util']),
+                        _column_mean(resources['gpu_freq_percent']),
+                        np.datetime64(datetime.now(), 'ms')
+                    ))
                     
-                    print(f"  Success: {len(successful_streams)}/{num_streams} streams")
+                    print(f"  Success: {num_successful}/{num_streams} streams")
                     print(f"  Avg FPS per stream: {avg_fps:.2f}")
-                    print(f"  Total FPS: {avg_fps * len(successful_streams):.2f}")
+                    print(f"  Total FPS: {avg_fps * num_successful:.2f}")
                 
                 # Check if performance is degrading significantly
-                if len(successful_streams) < num_streams * 0.5:  # Less than 50% success
+                if num_successful < num_streams * 0.5:  # Less than 50% success
                     print(f"  Performance degraded significantly, stopping at {num_streams} streams")
                     break
                     
                 time.sleep(2)  # Brief pause between tests
     
+    def _run_sharded_streams(self, processor, sources, duration, fps_target, num_workers):
+        """Split sources across worker processes, each running its own batched pipeline"""
+        # Each worker loads its own model instances and batches only its
+        # shard, so this gives up cross-stream batching and multiplies model
+        # memory by the number of workers. In exchange the run measures how
+        # the host scales with independent pipelines rather than one shared
+        # one.
+        num_workers = min(num_workers, len(sources))
+        bounds = [i * len(sources) // num_workers for i in range(num_workers + 1)]
+        
+        # forkserver starts workers from a clean process instead of
+        # copying this one's heap
+        context = multiprocessing.get_context('forkserver')
+        
+        # Workers take different times to start and load their models, so
+        # each waits here after reaching PLAYING; otherwise the shards'
+        # measurement windows would only partly overlap
+        with context.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+            start_barrier = manager.Barrier(num_workers)
+            shards = list(zip(bounds, bounds[1:]))
+            futures = [
+                executor.submit(
+                    processor.run_batched_streams,
+                    sources[start:end],
+                    duration,
+                    fps_target,
+                    start,
+                    len(sources),
+                    start_barrier
+                )
+                for start, end in shards
+            ]
+            
+            # A shard that raised is reported as failed streams instead of
+            # aborting the run. A worker that died (BrokenProcessPool) breaks
+            # the pool, failing every shard that had not finished yet.
+            stream_results = []
+            for (start, end), future in zip(shards, futures):
+                try:
+                    stream_results.extend(future.result())
+                except Exception as e:
+                    stream_results.extend({
+                        'stream_id': f"stream_{i}",
+                        'device': processor.device,
+                        'error': str(e) or type(e).__name__,
+                        'success': False
+                    } for i in range(start, end))
+        
+        return stream_results
+    
     def find_optimal_configuration(self):
         """Analyze results to find optimal configurations"""
-        if not self.results:
+        if not len(self.results):
             return None
             
-        # Group by device
-        cpu_results = [r for r in self.results if r['device'] == 'CPU']
-        gpu_results = [r for r in self.results if r['device'] == 'GPU']
-        
         analysis = {}
         
-        for device, results in [('CPU', cpu_results), ('GPU', gpu_results)]:
-            if not results:
+        for device in ('CPU', 'GPU'):
+            # Group by device
+            results = self.results[self.results['device'] == device]
+            if not len(results):
                 continue
                 
             # Find maximum streams
-            max_streams = max(r['num_streams'] for r in results)
+            max_streams = int(results['num_streams'].max())
             
             # Find best FPS configuration
-            best_fps_config = max(results, key=lambda x: x['total_fps'])
+            best_fps_config = _result_row(results[np.argmax(results['total_fps'])])
             
             # Find bottleneck point (where performance starts degrading)
-            sorted_results = sorted(results, key=lambda x: (x['target_fps'], x['num_streams']))
-            bottleneck_stream_count = max_streams
+            # i.e. the first step to more streams at the same FPS target where
+            # per-stream FPS drops by more than 20%
+            sorted_results = results[np.lexsort((results['num_streams'], results['target_fps']))]
+            fps = sorted_results['avg_fps_per_stream']
+            target_fps = sorted_results['target_fps']
+            degraded = np.flatnonzero(
+                (fps[1:] < fps[:-1] * 0.8) & (target_fps[1:] == target_fps[:-1])
+            )
             
-            for i in range(1, len(sorted_results)):
-                curr = sorted_results[i]
-                prev = sorted_results[i-1]
-                
-                if (curr['avg_fps_per_stream'] < prev['avg_fps_per_stream'] * 0.8 and 
-                    curr['target_fps'] == prev['target_fps']):
-                    bottleneck_stream_count = prev['num_streams']
-                    break
+            if len(degraded):
+                bottleneck_stream_count = int(sorted_results['num_streams'][degraded[0]])
+            else:
+                bottleneck_stream_count = max_streams
             
             analysis[device] = {
                 'max_streams': max_streams,
@@ -312,54 +760,163 @@ class PerformanceBenchmark:
     
     def save_results(self, filename="benchmark_results.json"):
         """Save benchmark results to file"""
+        rows = [_result_row(row) for row in self.results]
         report_data = {
             'system_info': self.get_system_info(),
-            'benchmark_results': self.results,
+            'benchmark_results': rows,
             'analysis': self.find_optimal_configuration(),
             'timestamp': datetime.now().isoformat()
         }
         
-        with open(filename, 'w') as f:
-            json.dump(report_data, f, indent=2)
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(report_data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
         
-        # Also save as CSV for easy analysis
+        # Also save as CSV for easy analysis, written straight from the columns
         csv_filename = filename.replace('.json', '.csv')
-        with open(csv_filename, 'w', newline='') as f:
-            if self.results:
-                writer = csv.DictWriter(f, fieldnames=self.results[0].keys())
-                writer.writeheader()
-                writer.writerows(self.results)
+        csv_formats = [
+            '%d' if RESULTS_DTYPE[name].kind == 'i' else '%.4f' if RESULTS_DTYPE[name].kind == 'f' else '%s'
+            for name in RESULTS_DTYPE.names
+        ]
+        np.savetxt(
+            csv_filename,
+            self.results,
+            fmt=csv_formats,
+            delimiter=',',
+            header=','.join(RESULTS_DTYPE.names),
+            comments=''
+        )
         
         print(f"\nResults saved to {filename} and {csv_filename}")
 
-def download_models():
+def _result_row(row):
+    """Convert one structured result row to a plain dict"""
+    result = {name: row[name].item() for name in RESULTS_DTYPE.names}
+    result['timestamp'] = result['timestamp'].isoformat()
+    return result
+
+def _find_named_ancestor(element, names):
+    """Walk up from an element or pad to the nearest ancestor named in names"""
+    while element is not None:
+        if element.get_name() in names:
+            return element.get_name()
+        element = element.get_parent()
+    return None
+
+def _pass_barrier(barrier):
+    """Wait for the other shards at a start barrier, going ahead if it breaks"""
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+
+def _end_branch(pipeline, stream_id):
+    """Send EOS into the metadata funnel on behalf of a stream's branch"""
+    meta = pipeline.get_by_name(f"meta_{stream_id}")
+    funnel_pad = meta.get_static_pad('src').get_peer() if meta is not None else None
+    if funnel_pad is not None:
+        funnel_pad.send_event(Gst.Event.new_eos())
+
+def _parse_cpulist(cpulist):
+    """Expand a sysfs CPU list such as '0-3,8-11' into a set of CPU ids"""
+    cpus = set()
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def numa_cpusets():
+    """CPU sets of each NUMA node, limited to the CPUs this process may use"""
+    allowed = os.sched_getaffinity(0)
+    nodes = sorted(
+        Path('/sys/devices/system/node').glob('node[0-9]*'),
+        key=lambda node: int(node.name[len('node'):])
+    )
+    
+    cpusets = []
+    for node in nodes:
+        try:
+            cpus = _parse_cpulist((node / 'cpulist').read_text()) & allowed
+        except OSError:
+            continue
+        if cpus:
+            cpusets.append(cpus)
+            
+    return cpusets or [allowed]
+
+def _find_intel_gpu():
+    """Return the sysfs directory of an Intel GPU, or None if there is none"""
+    try:
+        vendor = (INTEL_GPU_SYSFS / 'device' / 'vendor').read_text().strip()
+    except OSError:
+        return None
+    return INTEL_GPU_SYSFS if vendor == INTEL_VENDOR_ID else None
+
+def _column_mean(column):
+    """Average a resource sample column, 0 when nothing was sampled"""
+    # array('f') exposes its buffer, so NumPy reduces it without a copy
+    return float(np.frombuffer(column, dtype=np.float32).mean()) if column else 0.0
+
+def model_xml(model_dir, model, precision=MODEL_PRECISION):
+    """Path of a model's IR file in the Open Model Zoo downloader layout"""
+    return f"{model_dir}/intel/{model}/{precision}/{model}.xml"
+
+async def _download_model(model, precision):
+    """Run omz_downloader for one model and return its exit code"""
+    process = await asyncio.create_subprocess_exec(
+        "omz_downloader",
+        "--name", model,
+        "--output_dir", "./models",
+        "--precisions", precision,
+        "--num_attempts", "3"
+    )
+    return await process.wait()
+
+async def _download_all(models, precision):
+    """Download all models concurrently"""
+    return await asyncio.gather(
+        *[_download_model(model, precision) for model in models],
+        return_exceptions=True
+    )
+
+def download_models(precision=MODEL_PRECISION):
     """Download Intel OpenVINO models if not present"""
     model_dir = Path("./models")
     model_dir.mkdir(exist_ok=True)
     
     models = [
-        "person-detection-retail-0013",
-        "person-attributes-recognition-crossroad-0230"
+        DETECTION_MODEL,
+        CLASSIFICATION_MODEL
     ]
     
-    for model in models:
-        model_path = model_dir / f"{model}.xml"
-        if not model_path.exists():
-            print(f"Downloading {model}...")
-            # In practice, you'd use OpenVINO Model Downloader
-            # omz_downloader --name {model} --output_dir ./models
-            cmd = f"omz_downloader --name {model} --output_dir ./models"
-            try:
-                subprocess.run(cmd, shell=True, check=True)
-            except subprocess.CalledProcessError:
-                print(f"Failed to download {model}. Please install OpenVINO Model Zoo tools.")
-                print("Run: pip install openvino-dev[onnx,tensorflow2]")
-                return False
+    # One directory scan instead of a stat per model
+    existing = {str(path) for path in model_dir.glob(f"intel/*/{precision}/*.xml")}
+    missing = [model for model in models if model_xml(model_dir, model, precision) not in existing]
+    if not missing:
+        return True
+    
+    print(f"Downloading {', '.join(missing)}...")
+    exit_codes = asyncio.run(_download_all(missing, precision))
+    
+    failed = [model for model, code in zip(missing, exit_codes) if code != 0]
+    if failed:
+        print(f"Failed to download {', '.join(failed)}. Please install OpenVINO Model Zoo tools.")
+        print("Run: pip install openvino-dev[onnx,tensorflow2]")
+        return False
     
     return True
 
 def main():
     """Main benchmark execution"""
+    parser = argparse.ArgumentParser(description="AI camera processing pipeline benchmark")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="split streams across this many processes, each with its own "
+             "pipeline and model instances (default: 1, one batched pipeline)"
+    )
+    args = parser.parse_args()
+    
     print("AI Camera Processing Pipeline Benchmark")
     print("=" * 50)
     
@@ -399,7 +956,8 @@ def main():
         existing_videos,
         device="CPU",
         max_streams=8,
-        fps_targets=[15, 30]
+        fps_targets=[15, 30],
+        num_workers=args.workers
     )
     
     # Run GPU benchmark if GPU is available
@@ -408,7 +966,8 @@ def main():
             existing_videos,
             device="GPU",
             max_streams=16,
-            fps_targets=[15, 30, 60]
+            fps_targets=[15, 30, 60],
+            num_workers=args.workers
         )
     
     # Analyze and save results